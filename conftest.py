@@ -443,6 +443,15 @@ def lt_ctx(inline_executor):
     return lt.Context(executor=inline_executor)
 
 
+@pytest.fixture(scope="module")
+def lt_ctx_module():
+    """
+    Context shared by all tests in a module, for tests that only run
+    jobs and UDFs and don't modify the Context or its executor
+    """
+    return lt.Context(executor=InlineJobExecutor(debug=True))
+
+
 @pytest.fixture
 async def async_executor(local_cluster_url):
 
@@ -200,6 +200,9 @@ class DMDataSet(DataSet):
         self._image_count = sum(self._z_sizes.values())
         if self._nav_shape is None:
             self._nav_shape = (sum(self._z_sizes.values()),)
+        self._nav_shape_product = int(np.prod(self._nav_shape))
+        # validate sync_offset before loading the first file for sig shape and dtype:
+        self._sync_offset_info = self.get_sync_offset_info()
         native_sig_shape, native_dtype = executor.run_function(self._get_sig_shape_and_native_dtype)
         if self._sig_shape is None:
             self._sig_shape = tuple(native_sig_shape)
@@ -208,8 +211,6 @@ class DMDataSet(DataSet):
                 "sig_shape must be of size: %s" % int(np.prod(native_sig_shape))
             )
         shape = self._nav_shape + self._sig_shape
-        self._nav_shape_product = int(np.prod(self._nav_shape))
-        self._sync_offset_info = self.get_sync_offset_info()
         self._meta = DataSetMeta(
             shape=Shape(shape, sig_dims=len(self._sig_shape)),
             raw_dtype=native_dtype,
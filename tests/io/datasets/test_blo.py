@@ -3,45 +3,104 @@ import pickle
 import json
 
 import numpy as np
+import scipy.sparse as sp
 import pytest
 
 from libertem.job.masks import ApplyMasksJob
 from libertem.analysis.raw import PickFrameAnalysis
-from libertem.executor.inline import InlineJobExecutor
-from libertem.io.dataset.blo import BloDataSet
-from libertem.io.dataset.base import TilingScheme
-from libertem.common import Shape
+from libertem.io.dataset.blo import BloDataSet, get_header_dtype_list, MAGIC_EXPECT
 from libertem.udf.sumsigudf import SumSigUDF
 
-from utils import dataset_correction_verification, get_testdata_path
+from utils import (
+    dataset_correction_verification, get_testdata_path, default_tiling_scheme,
+    _check_sync_offset, reduce_all,
+)
 
 BLO_TESTDATA_PATH = os.path.join(get_testdata_path(), 'default.blo')
 HAVE_BLO_TESTDATA = os.path.exists(BLO_TESTDATA_PATH)
 
-pytestmark = pytest.mark.skipif(not HAVE_BLO_TESTDATA, reason="need .blo testdata")  # NOQA
+needs_blo_testdata = pytest.mark.skipif(not HAVE_BLO_TESTDATA, reason="need .blo testdata")
+
+
+def _mk_blo(filename, nav_shape, dp_size):
+    """
+    write a minimal .blo file with random frames
+    """
+    ny, nx = nav_shape
+    header = np.zeros(1, dtype=get_header_dtype_list('<'))
+    header['ID'] = b'IMGBLO'
+    header['MAGIC'] = MAGIC_EXPECT
+    header['Data_offset_1'] = vbf_offset = 0x1000
+    header['Data_offset_2'] = dp_offset = vbf_offset + ny * nx
+    header['DP_SZ'] = dp_size
+    header['NX'] = nx
+    header['NY'] = ny
+    with open(filename, 'wb') as f:
+        header.tofile(f)
+    # each frame is preceded by a 6 byte frame header:
+    frames = np.memmap(
+        filename, mode='r+', dtype=np.uint8, offset=dp_offset,
+        shape=(ny * nx, 6 + dp_size * dp_size),
+    )
+    frames[:, :2] = (0xAA, 0x55)
+    frames[:, 2:6] = np.arange(ny * nx, dtype='<u4').view(np.uint8).reshape((-1, 4))
+    frames[:, 6:] = np.random.randint(0, 256, size=(ny * nx, dp_size * dp_size))
+    frames.flush()
+    del frames
+
+
+@pytest.fixture(scope='session')
+def synthetic_blo(tmpdir_factory):
+    datadir = tmpdir_factory.mktemp('data')
+    filename = str(datadir + '/synthetic.blo')
+    _mk_blo(filename, nav_shape=(20, 24), dp_size=144)
+    yield filename
 
 
-@pytest.fixture()
-def default_blo():
+@pytest.fixture(scope="module")
+def default_blo(lt_ctx_module, synthetic_blo):
     ds = BloDataSet(
-        path=str(BLO_TESTDATA_PATH),
+        path=synthetic_blo,
     )
-    ds.initialize(InlineJobExecutor())
+    ds.initialize(lt_ctx_module.executor)
     return ds
 
 
+@pytest.fixture(scope="module")
+def first_frame_roi(default_blo):
+    roi = np.zeros(default_blo.shape.nav, dtype=bool)
+    roi[:1] = True
+    return roi
+
+
+@pytest.fixture(scope="module")
+def baseline_sumsig_4x2(lt_ctx_module, synthetic_blo):
+    ds = lt_ctx_module.load("blo", path=synthetic_blo, nav_shape=(4, 2))
+    result = lt_ctx_module.run_udf(dataset=ds, udf=SumSigUDF())
+    return result['intensity'].raw_data
+
+
 def test_simple_open(default_blo):
-    assert tuple(default_blo.shape) == (90, 121, 144, 144)
+    assert tuple(default_blo.shape) == (20, 24, 144, 144)
+
+
+@needs_blo_testdata
+def test_simple_open_testdata(lt_ctx_module):
+    ds = BloDataSet(
+        path=str(BLO_TESTDATA_PATH),
+    )
+    ds.initialize(lt_ctx_module.executor)
+    assert tuple(ds.shape) == (90, 121, 144, 144)
 
 
 def test_check_valid(default_blo):
     assert default_blo.check_valid()
 
 
-def test_detect():
+def test_detect(lt_ctx_module, synthetic_blo):
     assert BloDataSet.detect_params(
-        path=str(BLO_TESTDATA_PATH),
-        executor=InlineJobExecutor()
+        path=synthetic_blo,
+        executor=lt_ctx_module.executor
     )["parameters"]
 
 
@@ -50,14 +109,7 @@ def test_read(default_blo):
     p = next(partitions)
     # FIXME: partition shape can vary by number of cores
     # assert tuple(p.shape) == (11, 121, 144, 144)
-    tileshape = Shape(
-        (8,) + tuple(default_blo.shape.sig),
-        sig_dims=default_blo.shape.sig.dims
-    )
-    tiling_scheme = TilingScheme.make_for_shape(
-        tileshape=tileshape,
-        dataset_shape=default_blo.shape,
-    )
+    tiling_scheme = default_tiling_scheme(default_blo, tile_nav=8)
 
     tiles = p.get_tiles(tiling_scheme=tiling_scheme)
     t = next(tiles)
@@ -76,75 +128,71 @@ def test_pickle_fileset_is_small(default_blo):
     assert len(pickled) < 1024
 
 
-def test_apply_mask_on_raw_job(default_blo, lt_ctx):
-    mask = np.ones((144, 144))
+def test_apply_mask_on_raw_job(default_blo, lt_ctx_module):
+    mask = sp.csr_matrix(np.ones((144, 144)))
 
     job = ApplyMasksJob(dataset=default_blo, mask_factories=[lambda: mask])
-    out = job.get_result_buffer()
-
-    executor = InlineJobExecutor()
-
-    for tiles in executor.run_job(job):
-        for tile in tiles:
-            tile.reduce_into_result(out)
-
-    results = lt_ctx.run(job)
-    assert results[0].shape == (90 * 121,)
+    out = reduce_all(lt_ctx_module.executor, job, job.get_result_buffer())
+    assert out[0].shape == (20 * 24,)
 
 
 @pytest.mark.parametrize(
     'TYPE', ['JOB', 'UDF']
 )
-def test_apply_mask_analysis(default_blo, lt_ctx, TYPE):
-    mask = np.ones((144, 144))
-    analysis = lt_ctx.create_mask_analysis(factories=[lambda: mask], dataset=default_blo)
+def test_apply_mask_analysis(default_blo, lt_ctx_module, TYPE):
+    mask = sp.csr_matrix(np.ones((144, 144)))
+    analysis = lt_ctx_module.create_mask_analysis(factories=[lambda: mask], dataset=default_blo)
     analysis.TYPE = TYPE
-    results = lt_ctx.run(analysis)
-    assert results[0].raw_data.shape == (90, 121)
+    results = lt_ctx_module.run(analysis)
+    assert results[0].raw_data.shape == (20, 24)
 
 
-def test_sum_analysis(default_blo, lt_ctx):
-    analysis = lt_ctx.create_sum_analysis(dataset=default_blo)
-    results = lt_ctx.run(analysis)
+def test_sum_analysis(default_blo, lt_ctx_module):
+    analysis = lt_ctx_module.create_sum_analysis(dataset=default_blo)
+    results = lt_ctx_module.run(analysis)
     assert results[0].raw_data.shape == (144, 144)
 
 
-def test_pick_job(default_blo, lt_ctx):
-    analysis = lt_ctx.create_pick_job(dataset=default_blo, origin=(16,))
-    results = lt_ctx.run(analysis)
+def test_pick_job(default_blo, lt_ctx_module):
+    analysis = lt_ctx_module.create_pick_job(dataset=default_blo, origin=(16,))
+    results = lt_ctx_module.run(analysis)
     assert results.shape == (144, 144)
 
 
 @pytest.mark.parametrize(
     'TYPE', ['JOB', 'UDF']
 )
-def test_pick_analysis(default_blo, lt_ctx, TYPE):
+def test_pick_analysis(default_blo, lt_ctx_module, TYPE):
     analysis = PickFrameAnalysis(dataset=default_blo, parameters={"x": 16, "y": 16})
     analysis.TYPE = TYPE
-    results = lt_ctx.run(analysis)
+    results = lt_ctx_module.run(analysis)
     assert results[0].raw_data.shape == (144, 144)
 
 
 @pytest.mark.parametrize(
-    "with_roi", (True, False)
+    # without roi, the whole dataset is corrected, so only run that once
+    "with_roi,exclude", (
+        (True, None),
+        (True, [(55, 92), (61, 31)]),
+        (False, [(55, 92), (61, 31)]),
+    )
 )
-def test_correction(default_blo, lt_ctx, with_roi):
+def test_correction(default_blo, first_frame_roi, lt_ctx_module, with_roi, exclude):
     ds = default_blo
 
     if with_roi:
-        roi = np.zeros(ds.shape.nav, dtype=bool)
-        roi[:1] = True
+        roi = first_frame_roi
     else:
         roi = None
 
-    dataset_correction_verification(ds=ds, roi=roi, lt_ctx=lt_ctx, exclude=[(55, 92), (61, 31)])
-    dataset_correction_verification(ds=ds, roi=roi, lt_ctx=lt_ctx)
+    dataset_correction_verification(ds=ds, roi=roi, lt_ctx=lt_ctx_module, exclude=exclude)
 
 
 def test_cache_key_json_serializable(default_blo):
     json.dumps(default_blo.get_cache_key())
 
 
+@needs_blo_testdata
 @pytest.mark.dist
 def test_blo_dist(dist_ctx):
     ds = BloDataSet(path="/data/default.blo")
@@ -154,69 +202,36 @@ def test_blo_dist(dist_ctx):
     assert results[0].raw_data.shape == (144, 144)
 
 
-def test_positive_sync_offset(lt_ctx):
-    udf = SumSigUDF()
-    sync_offset = 2
-
-    ds = lt_ctx.load(
-        "blo", path=BLO_TESTDATA_PATH, nav_shape=(4, 2),
-    )
-
-    result = lt_ctx.run_udf(dataset=ds, udf=udf)
-    result = result['intensity'].raw_data[sync_offset:]
-
-    ds_with_offset = lt_ctx.load(
-        "blo", path=BLO_TESTDATA_PATH, nav_shape=(4, 2), sync_offset=sync_offset
-    )
-
-    result_with_offset = lt_ctx.run_udf(dataset=ds_with_offset, udf=udf)
-    result_with_offset = result_with_offset['intensity'].raw_data[
-        :ds_with_offset._meta.shape.nav.size - sync_offset
-    ]
-
-    assert np.allclose(result, result_with_offset)
-
-
-def test_negative_sync_offset(lt_ctx):
-    udf = SumSigUDF()
-    sync_offset = -2
-
-    ds = lt_ctx.load(
-        "blo", path=BLO_TESTDATA_PATH, nav_shape=(4, 2),
-    )
-
-    result = lt_ctx.run_udf(dataset=ds, udf=udf)
-    result = result['intensity'].raw_data[:ds._meta.shape.nav.size - abs(sync_offset)]
-
-    ds_with_offset = lt_ctx.load(
-        "blo", path=BLO_TESTDATA_PATH, nav_shape=(4, 2), sync_offset=sync_offset
-    )
-
-    result_with_offset = lt_ctx.run_udf(dataset=ds_with_offset, udf=udf)
-    result_with_offset = result_with_offset['intensity'].raw_data[abs(sync_offset):]
-
-    assert np.allclose(result, result_with_offset)
-
+@pytest.mark.parametrize(
+    "sync_offset", (2, -2)
+)
+def test_sync_offset(lt_ctx_module, synthetic_blo, baseline_sumsig_4x2, sync_offset):
+    loader_kwargs = {"filetype": "blo", "path": synthetic_blo, "nav_shape": (4, 2)}
+    _check_sync_offset(lt_ctx_module, loader_kwargs, sync_offset, reference=baseline_sumsig_4x2)
 
-def test_offset_smaller_than_image_count(lt_ctx):
-    sync_offset = -10900
 
+@pytest.mark.parametrize(
+    "sync_offset", (-481, 481)
+)
+def test_offset_out_of_range(lt_ctx_module, synthetic_blo, sync_offset):
     with pytest.raises(Exception) as e:
-        lt_ctx.load(
+        lt_ctx_module.load(
             "blo",
-            path=BLO_TESTDATA_PATH,
+            path=synthetic_blo,
             sync_offset=sync_offset
         )
     assert e.match(
-        r"offset should be in \(-10890, 10890\), which is \(-image_count, image_count\)"
+        r"offset should be in \(-480, 480\), which is \(-image_count, image_count\)"
     )
 
 
-def test_offset_greater_than_image_count(lt_ctx):
-    sync_offset = 10900
-
+@needs_blo_testdata
+@pytest.mark.parametrize(
+    "sync_offset", (-10900, 10900)
+)
+def test_offset_out_of_range_testdata(lt_ctx_module, sync_offset):
     with pytest.raises(Exception) as e:
-        lt_ctx.load(
+        lt_ctx_module.load(
             "blo",
             path=BLO_TESTDATA_PATH,
             sync_offset=sync_offset
@@ -226,31 +241,31 @@ def test_offset_greater_than_image_count(lt_ctx):
     )
 
 
-def test_reshape_nav(lt_ctx):
+def test_reshape_nav(lt_ctx_module, synthetic_blo, baseline_sumsig_4x2):
     udf = SumSigUDF()
 
-    ds_with_1d_nav = lt_ctx.load("blo", path=BLO_TESTDATA_PATH, nav_shape=(8,))
-    result_with_1d_nav = lt_ctx.run_udf(dataset=ds_with_1d_nav, udf=udf)
+    ds_with_1d_nav = lt_ctx_module.load("blo", path=synthetic_blo, nav_shape=(8,))
+    result_with_1d_nav = lt_ctx_module.run_udf(dataset=ds_with_1d_nav, udf=udf)
     result_with_1d_nav = result_with_1d_nav['intensity'].raw_data
 
-    ds_with_2d_nav = lt_ctx.load("blo", path=BLO_TESTDATA_PATH, nav_shape=(4, 2))
-    result_with_2d_nav = lt_ctx.run_udf(dataset=ds_with_2d_nav, udf=udf)
-    result_with_2d_nav = result_with_2d_nav['intensity'].raw_data
+    # the (4, 2) result is already computed for the sync_offset tests
+    result_with_2d_nav = baseline_sumsig_4x2
 
-    ds_with_3d_nav = lt_ctx.load("blo", path=BLO_TESTDATA_PATH, nav_shape=(2, 2, 2))
-    result_with_3d_nav = lt_ctx.run_udf(dataset=ds_with_3d_nav, udf=udf)
-    result_with_3d_nav = result_with_3d_nav['intensity'].raw_data
+    # all nav shapes read the same frames, so only check the metadata for 3D
+    ds_with_3d_nav = lt_ctx_module.load("blo", path=synthetic_blo, nav_shape=(2, 2, 2))
+    assert tuple(ds_with_3d_nav.shape.nav) == (2, 2, 2)
+    assert ds_with_3d_nav.shape.nav.size == result_with_1d_nav.shape[0]
 
-    assert np.allclose(result_with_1d_nav, result_with_2d_nav, result_with_3d_nav)
+    assert np.array_equal(result_with_1d_nav.ravel(), result_with_2d_nav.ravel())
 
 
-def test_incorrect_sig_shape(lt_ctx):
+def test_incorrect_sig_shape(lt_ctx_module, synthetic_blo):
     sig_shape = (5, 5)
 
     with pytest.raises(Exception) as e:
-        lt_ctx.load(
+        lt_ctx_module.load(
             "blo",
-            path=BLO_TESTDATA_PATH,
+            path=synthetic_blo,
             sig_shape=sig_shape
         )
     assert e.match(
@@ -7,31 +7,51 @@ import pytest
 
 from libertem.io.dataset.dm import DMDataSet
 from libertem.udf.sum import SumUDF
-from libertem.common import Shape
 from libertem.udf.sumsigudf import SumSigUDF
-from utils import dataset_correction_verification, get_testdata_path
-from libertem.io.dataset.base import TilingScheme
+from utils import (
+    dataset_correction_verification, get_testdata_path, default_tiling_scheme,
+    _check_sync_offset,
+)
 
 DM_TESTDATA_PATH = os.path.join(get_testdata_path(), 'dm')
 HAVE_DM_TESTDATA = os.path.exists(DM_TESTDATA_PATH)
 
-pytestmark = pytest.mark.skipif(not HAVE_DM_TESTDATA, reason="need .dm4 testdata")  # NOQA
+if not HAVE_DM_TESTDATA:
+    pytest.skip("need .dm4 testdata", allow_module_level=True)
+
+
+def _sorted_files(path, suffix):
+    with os.scandir(path) as it:
+        return sorted(entry.path for entry in it if entry.name.endswith(suffix))
 
 
-@pytest.fixture
-def default_dm(lt_ctx):
-    files = list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4'))))
-    ds = lt_ctx.load("dm", files=files)
+@pytest.fixture(scope="session")
+def dm4_files():
+    return _sorted_files(DM_TESTDATA_PATH, '.dm4')
+
+
+@pytest.fixture(scope="module")
+def default_dm(lt_ctx_module, dm4_files):
+    ds = DMDataSet(files=dm4_files)
+    ds = ds.initialize(lt_ctx_module.executor)
     return ds
 
 
-@pytest.fixture
-def dm_stack_of_3d(lt_ctx):
-    files = list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '3D', '*.dm3'))))
-    ds = lt_ctx.load("dm", files=files)
+@pytest.fixture(scope="module")
+def dm_stack_of_3d(lt_ctx_module):
+    files = _sorted_files(os.path.join(DM_TESTDATA_PATH, '3D'), '.dm3')
+    ds = DMDataSet(files=files)
+    ds = ds.initialize(lt_ctx_module.executor)
     return ds
 
 
+@pytest.fixture(scope="module")
+def baseline_sumsig_4x2(lt_ctx_module, dm4_files):
+    ds = lt_ctx_module.load("dm", files=dm4_files, nav_shape=(4, 2))
+    result = lt_ctx_module.run_udf(dataset=ds, udf=SumSigUDF())
+    return result['intensity'].raw_data
+
+
 def test_simple_open(default_dm):
     assert tuple(default_dm.shape) == (10, 3838, 3710)
 
@@ -40,11 +60,11 @@ def test_check_valid(default_dm):
     default_dm.check_valid()
 
 
-def test_read_roi(default_dm, lt_ctx):
+def test_read_roi(default_dm, lt_ctx_module):
     roi = np.zeros((10,), dtype=bool)
     roi[5] = 1
-    sumj = lt_ctx.create_sum_analysis(dataset=default_dm)
-    sumres = lt_ctx.run(sumj, roi=roi)
+    sumj = lt_ctx_module.create_sum_analysis(dataset=default_dm)
+    sumres = lt_ctx_module.run(sumj, roi=roi)
     sha1 = hashlib.sha1()
     sha1.update(sumres.intensity.raw_data)
     assert sha1.hexdigest() == "e94ed671e20ccce33d288fbcadd0f54691a29b9c"
@@ -53,7 +73,7 @@ def test_read_roi(default_dm, lt_ctx):
 @pytest.mark.parametrize(
     "with_roi", (True, False)
 )
-def test_correction(default_dm, lt_ctx, with_roi):
+def test_correction(default_dm, lt_ctx_module, with_roi):
     ds = default_dm
 
     if with_roi:
@@ -62,29 +82,28 @@ def test_correction(default_dm, lt_ctx, with_roi):
     else:
         roi = None
 
-    dataset_correction_verification(ds=ds, roi=roi, lt_ctx=lt_ctx)
+    dataset_correction_verification(ds=ds, roi=roi, lt_ctx=lt_ctx_module)
 
 
-def test_detect_1(lt_ctx):
+def test_detect_1(lt_ctx_module):
     fpath = os.path.join(DM_TESTDATA_PATH, '2018-7-17 15_29_0000.dm4')
     assert DMDataSet.detect_params(
         path=fpath,
-        executor=lt_ctx.executor,
+        executor=lt_ctx_module.executor,
     )["parameters"] == {
         'files': [fpath],
     }
 
 
-def test_detect_2(lt_ctx):
+def test_detect_2(lt_ctx_module):
     assert DMDataSet.detect_params(
         path="nofile.someext",
-        executor=lt_ctx.executor,
+        executor=lt_ctx_module.executor,
     ) is False
 
 
-def test_same_offset(lt_ctx):
-    files = glob(os.path.join(DM_TESTDATA_PATH, '*.dm4'))
-    ds = lt_ctx.load("dm", files=files, same_offset=True)
+def test_same_offset(lt_ctx_module, dm4_files):
+    ds = lt_ctx_module.load("dm", files=dm4_files, same_offset=True)
     ds.check_valid()
 
 
@@ -106,7 +125,7 @@ def test_dm_dist(dist_ctx):
     assert results[0].raw_data.shape == (3838, 3710)
 
 
-def test_dm_stack_fileset_offsets(dm_stack_of_3d, lt_ctx):
+def test_dm_stack_fileset_offsets(dm_stack_of_3d, lt_ctx_module):
     fs = dm_stack_of_3d._get_fileset()
     f0, f1 = fs
 
@@ -118,82 +137,28 @@ def test_dm_stack_fileset_offsets(dm_stack_of_3d, lt_ctx):
     assert f1.start_idx == 20
     assert f1.end_idx == 40
 
-    lt_ctx.run_udf(dataset=dm_stack_of_3d, udf=SumUDF())
-
-
-def test_positive_sync_offset(lt_ctx):
-    udf = SumSigUDF()
-    sync_offset = 2
-
-    ds = lt_ctx.load(
-        "dm",
-        files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
-        nav_shape=(4, 2),
-    )
-
-    result = lt_ctx.run_udf(dataset=ds, udf=udf)
-    result = result['intensity'].raw_data[sync_offset:]
-
-    ds_with_offset = lt_ctx.load(
-        "dm",
-        files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
-        nav_shape=(4, 2),
-        sync_offset=sync_offset
-    )
-
-    result_with_offset = lt_ctx.run_udf(dataset=ds_with_offset, udf=udf)
-    result_with_offset = result_with_offset['intensity'].raw_data[
-        :ds_with_offset._meta.shape.nav.size - sync_offset
-    ]
+    lt_ctx_module.run_udf(dataset=dm_stack_of_3d, udf=SumUDF())
 
-    assert np.allclose(result, result_with_offset)
-
-
-def test_negative_sync_offset(lt_ctx):
-    udf = SumSigUDF()
-    sync_offset = -2
-
-    ds = lt_ctx.load(
-        "dm",
-        files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
-        nav_shape=(4, 2),
-    )
 
-    result = lt_ctx.run_udf(dataset=ds, udf=udf)
-    result = result['intensity'].raw_data[:ds._meta.shape.nav.size - abs(sync_offset)]
-
-    ds_with_offset = lt_ctx.load(
-        "dm",
-        files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
-        nav_shape=(4, 2),
-        sync_offset=sync_offset
-    )
-
-    result_with_offset = lt_ctx.run_udf(dataset=ds_with_offset, udf=udf)
-    result_with_offset = result_with_offset['intensity'].raw_data[abs(sync_offset):]
-
-    assert np.allclose(result, result_with_offset)
+@pytest.mark.parametrize(
+    "sync_offset", (2, -2)
+)
+def test_sync_offset(lt_ctx_module, dm4_files, baseline_sumsig_4x2, sync_offset):
+    loader_kwargs = {"filetype": "dm", "files": dm4_files, "nav_shape": (4, 2)}
+    _check_sync_offset(lt_ctx_module, loader_kwargs, sync_offset, reference=baseline_sumsig_4x2)
 
 
-def test_missing_frames(lt_ctx):
+def test_missing_frames(lt_ctx_module, dm4_files):
     """
     there can be some frames missing at the end
     """
     # one full row of additional frames in the data set than the number of files
     nav_shape = (3, 5)
-    files = list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4'))))
-    ds = DMDataSet(files=files, nav_shape=nav_shape)
+    ds = DMDataSet(files=dm4_files, nav_shape=nav_shape)
     ds.set_num_cores(4)
-    ds = ds.initialize(lt_ctx.executor)
+    ds = ds.initialize(lt_ctx_module.executor)
 
-    tileshape = Shape(
-        (1,) + tuple(ds.shape.sig),
-        sig_dims=ds.shape.sig.dims
-    )
-    tiling_scheme = TilingScheme.make_for_shape(
-        tileshape=tileshape,
-        dataset_shape=ds.shape,
-    )
+    tiling_scheme = default_tiling_scheme(ds, tile_nav=1)
 
     for p in ds.get_partitions():
         for t in p.get_tiles(tiling_scheme=tiling_scheme):
@@ -207,27 +172,14 @@ def test_missing_frames(lt_ctx):
     assert t.tile_slice.shape[0] == 1
 
 
-def test_offset_smaller_than_image_count(lt_ctx):
-    sync_offset = -12
-
-    with pytest.raises(Exception) as e:
-        lt_ctx.load(
-            "dm",
-            files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
-            sync_offset=sync_offset
-        )
-    assert e.match(
-        r"offset should be in \(-10, 10\), which is \(-image_count, image_count\)"
-    )
-
-
-def test_offset_greater_than_image_count(lt_ctx):
-    sync_offset = 12
-
+@pytest.mark.parametrize(
+    "sync_offset", (-12, 12)
+)
+def test_offset_out_of_range(lt_ctx_module, dm4_files, sync_offset):
     with pytest.raises(Exception) as e:
-        lt_ctx.load(
+        lt_ctx_module.load(
             "dm",
-            files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
+            files=dm4_files,
             sync_offset=sync_offset
         )
     assert e.match(
@@ -235,32 +187,31 @@ def test_offset_greater_than_image_count(lt_ctx):
     )
 
 
-def test_reshape_nav(lt_ctx):
+def test_reshape_nav(lt_ctx_module, dm4_files, baseline_sumsig_4x2):
     udf = SumSigUDF()
-    files = list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4'))))
 
-    ds_with_1d_nav = lt_ctx.load("dm", files=files, nav_shape=(8,))
-    result_with_1d_nav = lt_ctx.run_udf(dataset=ds_with_1d_nav, udf=udf)
+    ds_with_1d_nav = lt_ctx_module.load("dm", files=dm4_files, nav_shape=(8,))
+    result_with_1d_nav = lt_ctx_module.run_udf(dataset=ds_with_1d_nav, udf=udf)
     result_with_1d_nav = result_with_1d_nav['intensity'].raw_data
 
-    ds_with_2d_nav = lt_ctx.load("dm", files=files, nav_shape=(4, 2))
-    result_with_2d_nav = lt_ctx.run_udf(dataset=ds_with_2d_nav, udf=udf)
-    result_with_2d_nav = result_with_2d_nav['intensity'].raw_data
+    # the (4, 2) result is already computed for the sync_offset tests
+    result_with_2d_nav = baseline_sumsig_4x2
 
-    ds_with_3d_nav = lt_ctx.load("dm", files=files, nav_shape=(2, 2, 2))
-    result_with_3d_nav = lt_ctx.run_udf(dataset=ds_with_3d_nav, udf=udf)
-    result_with_3d_nav = result_with_3d_nav['intensity'].raw_data
+    # all nav shapes read the same frames, so only check the metadata for 3D
+    ds_with_3d_nav = lt_ctx_module.load("dm", files=dm4_files, nav_shape=(2, 2, 2))
+    assert tuple(ds_with_3d_nav.shape.nav) == (2, 2, 2)
+    assert ds_with_3d_nav.shape.nav.size == result_with_1d_nav.shape[0]
 
-    assert np.allclose(result_with_1d_nav, result_with_2d_nav, result_with_3d_nav)
+    assert np.array_equal(result_with_1d_nav.ravel(), result_with_2d_nav.ravel())
 
 
-def test_incorrect_sig_shape(lt_ctx):
+def test_incorrect_sig_shape(lt_ctx_module, dm4_files):
     sig_shape = (5, 5)
 
     with pytest.raises(Exception) as e:
-        lt_ctx.load(
+        lt_ctx_module.load(
             "dm",
-            files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
+            files=dm4_files,
             sig_shape=sig_shape
         )
     assert e.match(
@@ -268,13 +219,13 @@ def test_incorrect_sig_shape(lt_ctx):
     )
 
 
-def test_scan_size_deprecation(lt_ctx):
+def test_scan_size_deprecation(lt_ctx_module, dm4_files):
     scan_size = (2, 2)
 
     with pytest.warns(FutureWarning):
-        ds = lt_ctx.load(
+        ds = lt_ctx_module.load(
             "dm",
-            files=list(sorted(glob(os.path.join(DM_TESTDATA_PATH, '*.dm4')))),
+            files=dm4_files,
             scan_size=scan_size,
         )
     assert tuple(ds.shape) == (2, 2, 3838, 3710)
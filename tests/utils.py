@@ -1,4 +1,7 @@
 import datetime
+import functools
+import itertools
+import operator
 import time
 import os
 
@@ -12,8 +15,11 @@ from libertem.udf import UDF
 import libertem.common.backend as bae
 from libertem.udf.raw import PickUDF
 from libertem.udf.masks import ApplyMasksUDF
+from libertem.udf.sumsigudf import SumSigUDF
 from libertem.corrections import CorrectionSet
 from libertem.corrections.detector import correct
+from libertem.common import Shape
+from libertem.io.dataset.base import TilingScheme
 
 
 def _naive_mask_apply(masks, data):
@@ -235,6 +241,31 @@ def dataset_correction_masks(ds, roi, lt_ctx, exclude=None):
         )
 
 
+def _trim(raw, head, tail):
+    """
+    drop `head` entries from the start and `tail` entries from the end of `raw`
+    """
+    return raw[head:raw.shape[0] - tail if tail else None]
+
+
+def _check_sync_offset(ctx, loader_kwargs, sync_offset, reference):
+    """
+    compare the SumSigUDF result of a dataset loaded with `sync_offset`
+    against the `reference` result of the same dataset without offset
+    """
+    udf = SumSigUDF()
+
+    ds_with_offset = ctx.load(sync_offset=sync_offset, **loader_kwargs)
+    result_with_offset = ctx.run_udf(dataset=ds_with_offset, udf=udf)['intensity'].raw_data
+
+    skipped = max(0, sync_offset)
+    inserted = max(0, -sync_offset)
+    assert np.array_equal(
+        _trim(reference, head=skipped, tail=inserted),
+        _trim(result_with_offset, head=inserted, tail=skipped),
+    )
+
+
 def get_testdata_path():
     return os.environ.get(
         'TESTDATA_BASE_PATH',
@@ -242,3 +273,33 @@ def get_testdata_path():
             os.path.join(os.path.dirname(__file__), '..', 'data')
         )
     )
+
+
+@functools.lru_cache()
+def _make_tiling_scheme(shape, sig_dims, tile_nav):
+    dataset_shape = Shape(shape, sig_dims=sig_dims)
+    tileshape = Shape(
+        (tile_nav,) + tuple(dataset_shape.sig),
+        sig_dims=sig_dims
+    )
+    return TilingScheme.make_for_shape(
+        tileshape=tileshape,
+        dataset_shape=dataset_shape,
+    )
+
+
+def default_tiling_scheme(ds, tile_nav=8):
+    """
+    tiling scheme with `tile_nav` full frames per tile, cached per dataset shape
+    """
+    return _make_tiling_scheme(tuple(ds.shape), ds.shape.sig.dims, tile_nav)
+
+
+def reduce_all(executor, job, out):
+    """
+    run `job` on `executor` and reduce all result tiles into `out`
+    """
+    reduce_into_result = operator.methodcaller('reduce_into_result', out)
+    for tile in itertools.chain.from_iterable(executor.run_job(job)):
+        reduce_into_result(tile)
+    return out